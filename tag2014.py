@@ -17,7 +17,7 @@
 # ------------------------------------------------------------------------------
 # Original Author: Nick Principe, EMC Corporation <nick.principe@emc.com>
 # Additional Authors: Nick Principe, Individual <nick@princi.pe>
-# Version 1.6
+# Version 1.7
 # ------------------------------------------------------------------------------
 # Version History:
 # ----------------
@@ -45,6 +45,16 @@
 #       for a table-like output
 #     - Fixed a bug where -s mode did not have output setup for STDOUT
 #     - Fixed several areas where assumptions were made about None comparisons
+# 1.7 - Performance improvements for large data files
+#     - Repeated timestamp strings are only parsed once
+#     - Fixed -a, -c, and -s modes failing unless -p was specified
+#     - Fixed timestamp fields given with -f being discarded on the first row
+#     - The "Couldn't find a full timestamp" message is no longer printed for
+#       every row in -a mode
+#     - sflow counter/row warnings in -s mode now go to STDERR instead of
+#       being mixed into the CSV output on STDOUT
+#     - Rows no longer have to be in time order within each object, so the
+#       -p object column no longer affects the output (-p works like -c)
 
 import getopt
 import sys
@@ -52,6 +62,10 @@ import os.path
 import csv
 import re
 import io
+import functools
+import bisect
+import itertools
+import calendar
 from datetime import *
 from dateutil import parser
 from dateutil.relativedelta import *
@@ -112,12 +126,33 @@ SFLOW_CNTR_FIELD_RATE = [False, # CounterType
                          True,  # ifOutErrors
                          False, # ifPromiscuousMode
                         ]
+# indices of the fields that are converted to rates
+SFLOW_RATE_INDICES = tuple(idx for idx, rate in enumerate(SFLOW_CNTR_FIELD_RATE)
+                           if rate)
 SFLOW_RECORD_TYPE_IDX = 0
 SFLOW_CNTR_IP_FIELD_IDX = 1
 SFLOW_CNTR_IF_FIELD_IDX = 3
 SFLOW_CNTR_INOCT_FIELD_IDX = 8
 SFLOW_CNTR_OUTOCT_FIELD_IDX = 15
 
+# data and output files can be large, so read and write them in big chunks
+IO_BUFFER_SIZE = 1 << 20
+
+# strptime formats for common timestamps, month-first like dateutil assumes
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M:%S',
+                     '%Y-%m-%dT%H:%M:%S',
+                     '%Y-%m-%d %H:%M:%S.%f',
+                     '%Y-%m-%dT%H:%M:%S.%f',
+                     '%Y/%m/%d %H:%M:%S',
+                     '%m/%d/%Y %H:%M:%S',
+                     '%m/%d/%Y %H:%M',
+                     '%m/%d/%Y %I:%M:%S %p',
+                     '%m/%d/%Y %I:%M %p',
+                     '%m/%d/%Y, %H:%M:%S',
+                     '%m/%d/%Y, %I:%M:%S %p',
+                     '%a %b %d %H:%M:%S %Y', # sfslog
+                     ]
+
 def usage():
     print(
         "USAGE: tag2014.py {-a|-c|-s|-p obj_col} [-f ts_col ... ] [-m] [-r] [-n] [-e] "
@@ -127,7 +162,8 @@ def usage():
     print("     -c         : CSV data")
     print("     -s         : Sflowtool data")
     print("     -p obj_col : Single-pivoted CSV output, with an object column at ")
-    print("                  obj_col (0-index)")
+    print("                  obj_col (0-index); as of 1.7 the object column no")
+    print("                  longer affects the output, and -p works like -c")
     print()
     print("     -f ts_col : field(s) that contains timestamp information")
     print()
@@ -144,153 +180,223 @@ def usage():
     print("     -t time_shift : shift the time in the data file by time_shift seconds")
 
 
-def tagData(rd, wr):
-    reFullTimestamp = re.compile(
-        '^\s*\d{1,4}[/\-.]\d{1,4}[/\-.]\d{1,4}[T,]?\s+\d{1,2}[:.]\d{1,2}([:.]\d{1,2})?\s*([AP]M)?(.+)$')
-    reDatestamp = re.compile('^\s*\d{1,4}[/\-.]\d{1,4}[/\-.]\d{1,4}(.+)$')
-    reIPv4Addr = re.compile('^\s*\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\s*$')
-    reTimestamp = re.compile(
-        '^\s*\d{1,2}[:.]\d{1,2}[:.]\d{1,2}\s*([AP]M)?(.+)$')
+def timestampParser():
+    # dateutil is slow, but a given file (or sfslog) uses the same timestamp
+    # format throughout - so figure out which strptime format matches the
+    # first timestamp dateutil parses, and try that first from then on,
+    # falling back to dateutil for anything it doesn't handle
+    fmt = None
+    guessed = False
+
+    # timestamps also repeat a lot in the data (same second across many
+    # objects or interfaces), so remember what we've already parsed
+    @functools.lru_cache(maxsize=4096)
+    def parse(text):
+        nonlocal fmt, guessed
+        if fmt is not None:
+            try:
+                return datetime.strptime(text, fmt)
+            except ValueError:
+                pass
+        ts = parser.parse(text)
+        if not guessed:
+            guessed = True
+            for candidate in TIMESTAMP_FORMATS:
+                try:
+                    if datetime.strptime(text, candidate) == ts:
+                        fmt = candidate
+                        break
+                except ValueError:
+                    pass
+        return ts
+
+    return parse
+
+
+def readRows(infile):
+    # most data has no quoting at all, so split those lines ourselves and
+    # only hand lines with a quote in them to the csv reader (which pulls in
+    # any further lines a quoted field spans from the same file iterator)
+    lines = iter(infile)
+    for line in lines:
+        if '"' in line:
+            yield next(csv.reader(itertools.chain([line], lines),
+                                  delimiter=',', quotechar='"'))
+        else:
+            line = line.rstrip("\r\n")
+            if line:
+                yield line.split(",")
+            else:
+                yield []
+
+
+def tagData(rd, wr, out):
     datestampsFound = 0
     timestampsFound = 0
     foundFullTimestamp = 0
+    # once we know where the timestamp is (given with -f, or discovered in
+    # the data) stop looking for it
+    tsColsLocked = len(tsCols) > 0
+    # the file type doesn't change from row to row, so settle what it means
+    # for the per-row work once, up front
+    isSflow = fileType == "s"
+    # analyzer data has a fixed timestamp column, everything else has the
+    # timestamp column(s) given with -f or discovered in the data
+    fixedTsCol = fileType == "a"
     # handle the header
-    if fileType == "s":
+    if isSflow:
         header = SFLOW_CNTR_HEADERS
     else:
         header = next(rd)
-    header.insert(0, "Phase")
-    header.insert(0, "Run")
-    wr.writerow(header)
-    # index of current phase...
-    phaseIdx = 0
-    # keep track of current object for analyzer data, so we know
-    # when to start over run numbering, since we reached a new object
-    curobj = None
+    wr.writerow(["Run", "Phase", *header])
+    # most rows don't need any quoting, so for those we skip the csv writer
+    # and write the tags and the original fields straight to the output
+    # (sflow rows hold computed numbers rather than strings, so they always
+    # go through the csv writer)
+    quickWrite = not isSflow
+    phaseTagText = ["{0},{1},".format(run, label) for run, label in phaseTags]
+    lineEnd = wr.dialect.lineterminator
+    # ISO 8601 timestamps sort the same way as text as they do as times, so
+    # for those we can find the phase without parsing the timestamp at all,
+    # by comparing against the (shifted back) transition times as text.
+    # sflow needs the parsed timestamp to compute rates, though.
+    textTimes = None
+    if not isSflow and all(t.tzinfo is None for t in times):
+        shiftedTimes = times
+        if timeShift is not None:
+            shiftedTimes = [t - timeShift for t in times]
+        textTimes = {sep: tuple(t.isoformat(sep) for t in shiftedTimes)
+                     for sep in " T"}
     # keep track of last data point for sflow data to calculate rates
-    # note: this is a nested dict: IP => ifIndex => field => val => last_value
-    #                                                             => ts  => last_timestamp
+    # note: these are flat dicts: (IP, ifIndex, field) => last_value
+    #                             (IP, ifIndex) => last_timestamp
+    # (every counter in a row shares the row's timestamp, so it's only kept
+    # once per interface)
     sflowLastData = {}
+    sflowLastTs = {}
+    # look these up once, rather than for every row
+    parse = parseTimestamp
+    matchSortable = reSortableTimestamp.match
+    bisectLeft = bisect.bisect_left
+    write = out.write
+    writerow = wr.writerow
     for row in rd:
         ts = None
-        if fileType == "s" and not re.match("CNTR", row[SFLOW_RECORD_TYPE_IDX]):
+        if isSflow and not row[SFLOW_RECORD_TYPE_IDX].startswith("CNTR"):
             continue # skip all processing for non-CNTR types in sflowtool output
-        if (fileType == "c" or fileType == "s" or fileType == "p") and len(tsCols) == 0:
+        if not tsColsLocked and not fixedTsCol:
             # we need to find the ts column(s)
             for i in range(0, len(row)):
-                if reFullTimestamp.match(row[i]):
+                field = row[i]
+                if ("/" not in field and "-" not in field and "." not in field
+                        and ":" not in field):
+                    continue  # no date or time separators, so can't be either
+                if reFullTimestamp.match(field):
                     tsCols.append(i)
                     print("Discovered a timestamp field at index {0}".format(
                         i), file=sys.stderr)
                     foundFullTimestamp = 1
                     break  # only discover one full timestamp
-                elif datestampsFound == 0 and reDatestamp.match(row[i]) and not reIPv4Addr.match(row[i]):
+                elif datestampsFound == 0 and reDatestamp.match(field) and not reIPv4Addr.match(field):
                     tsCols.append(i)
                     print(
                         "Discovered a date-only timestamp field at index {0}".format(i), file=sys.stderr)
                     datestampsFound += 1
-                elif timestampsFound == 0 and reTimestamp.match(row[i]) and not reIPv4Addr.match(row[i]):
+                elif timestampsFound == 0 and reTimestamp.match(field) and not reIPv4Addr.match(field):
                     tsCols.append(i)
                     print(
                         "Discovered a time-only timestamp field at index {0}".format(i), file=sys.stderr)
                     timestampsFound += 1
-        if ((foundFullTimestamp == 0) and
-                (not (timestampsFound == 1 and datestampsFound == 1))):
-            timestampsFound = 0
-            datestampsFound = 0
-            del tsCols[:]
-            print("Couldn't find a full timestamp, skipping row...",
-                    file=sys.stderr)
-        try:
-            if fileType == "a":
-                if curobj == None:
-                    curobj = row[ana_obj_col]
-                else:
-                    if curobj != row[ana_obj_col]:
-                        phaseIdx = 0
-                        curobj = row[ana_obj_col]
-                ts = parser.parse(row[ana_ts_col])
-            elif fileType == "c" or fileType == "s":
-                timestampText = ""
-                for field in tsCols:
-                    timestampText += row[field]
-                    timestampText += " "
-                ts = parser.parse(timestampText)
-            elif fileType == "p":
-                if curobj == None:
-                    curobj = row[obj_col]
-                else:
-                    if curobj != row[obj_col]:
-                        phaseIdx = 0
-                        curobj = row[obj_col]
-                timestampText = ""
-                for field in tsCols:
-                    timestampText += row[field]
-                    timestampText += " "
-                ts = parser.parse(timestampText)
+            if ((foundFullTimestamp == 1) or
+                    (timestampsFound == 1 and datestampsFound == 1)):
+                tsColsLocked = True
             else:
-                assert False, "unhandled file type"
-        except ValueError:
-            continue  # skip where there is an invalid timestamp
-        except TypeError:
-            continue  # skip... but this is indicative of bad data format
+                timestampsFound = 0
+                datestampsFound = 0
+                del tsCols[:]
+                print("Couldn't find a full timestamp, skipping row...",
+                        file=sys.stderr)
+        if fixedTsCol:
+            timestampText = row[ana_ts_col]
+        else:
+            timestampText = " ".join(row[field] for field in tsCols)
+        sortable = None
+        if textTimes is not None:
+            sortable = matchSortable(timestampText)
+            # the pattern only limits the day to 31, so anything past the
+            # 28th still has to fit the month - otherwise leave it to the
+            # parser, which will reject it
+            if (sortable is not None and sortable.group('day') > "28" and
+                    int(sortable.group('day')) > calendar.monthrange(
+                        int(sortable.group('year')),
+                        int(sortable.group('month')))[1]):
+                sortable = None
+        if sortable is None:
+            try:
+                ts = parse(timestampText)
+            except ValueError:
+                continue  # skip where there is an invalid timestamp
+            except TypeError:
+                continue  # skip... but this is indicative of bad data format
 
-        # This is where we hack time like Kung Fury
-        if timeShift is not None:
-            ts += timeShift
+            # This is where we hack time like Kung Fury
+            if timeShift is not None:
+                ts += timeShift
 
         all_rates_good = True
-        if fileType == "s":
+        if isSflow:
             if len(row) != len(SFLOW_CNTR_FIELD_RATE):
-                print("Unexpected number of fields in sflowtool CNTR row! Skipping row")
+                print("Unexpected number of fields in sflowtool CNTR row! Skipping row",
+                      file=sys.stderr)
                 sflowLastData = {} # we lose our baseline data to compute rates if we skip
+                sflowLastTs = {}
                 continue
             sflowIP = row[SFLOW_CNTR_IP_FIELD_IDX]
             sflowIF = row[SFLOW_CNTR_IF_FIELD_IDX]
-            if sflowIP not in sflowLastData:
-                sflowLastData[sflowIP] = {}
-            if sflowIF not in sflowLastData[sflowIP]:
-                sflowLastData[sflowIP][sflowIF] = {}
-            for idx in range(0,len(SFLOW_CNTR_FIELD_RATE)):
-                if SFLOW_CNTR_FIELD_RATE[idx] is True:
-                    if idx not in sflowLastData[sflowIP][sflowIF]:
-                        sflowLastData[sflowIP][sflowIF][idx] = {}
-                    try:
-                        new_val = int(row[idx])
-                    except ValueError as ve:
-                        print('Encountered invalid counter value "{}", invalidating that counter'.format(row[idx]))
-                        all_rates_good = False
-                        sflowLastData[sflowIP][sflowIF][idx] = {}
-                        row[idx] = None
-                        continue
-                    if ('val' in sflowLastData[sflowIP][sflowIF][idx]
-                        and 'ts' in sflowLastData[sflowIP][sflowIF][idx]):
-                        old_val = sflowLastData[sflowIP][sflowIF][idx]['val']
-                        old_ts = sflowLastData[sflowIP][sflowIF][idx]['ts']
-                        cur_rate = (new_val - old_val) / (ts - old_ts).total_seconds()
-                        row[idx] = cur_rate
-                    else:
-                        all_rates_good = False
-                        row[idx] = None
-                    sflowLastData[sflowIP][sflowIF][idx]['val'] = new_val
-                    sflowLastData[sflowIP][sflowIF][idx]['ts'] = ts
-
-
-        iter_run = -1
-        iter_phase = "error"
+            old_ts = sflowLastTs.get((sflowIP, sflowIF))
+            if old_ts is not None:
+                elapsed = (ts - old_ts).total_seconds()
+            else:
+                elapsed = None  # first sample for this interface
+            sflowLastTs[(sflowIP, sflowIF)] = ts
+            for idx in SFLOW_RATE_INDICES:
+                key = (sflowIP, sflowIF, idx)
+                try:
+                    new_val = int(row[idx])
+                except ValueError as ve:
+                    print('Encountered invalid counter value "{}", invalidating that counter'.format(row[idx]),
+                          file=sys.stderr)
+                    all_rates_good = False
+                    sflowLastData.pop(key, None)
+                    row[idx] = None
+                    continue
+                old_val = sflowLastData.get(key)
+                if elapsed is not None and old_val is not None:
+                    cur_rate = (new_val - old_val) / elapsed
+                    row[idx] = cur_rate
+                else:
+                    all_rates_good = False
+                    row[idx] = None
+                sflowLastData[key] = new_val
+
         # Now we have the current timestamp of the data.
-        # Sync to the start (skip phases that aren't in the data)
-        while ((phaseIdx < (len(times) - 1)) and
-               (ts > times[phaseIdx + 1])):
-            phaseIdx += 1
+        # Find the last phase that started strictly before it (times is
+        # sorted, so this doesn't depend on row order, and objects in
+        # analyzer/pivoted data don't need to start over from the first phase)
+        if sortable is not None:
+            phaseIdx = max(0, bisectLeft(
+                textTimes[sortable.group('sep')], timestampText) - 1)
+        else:
+            phaseIdx = max(0, bisectLeft(times, ts) - 1)
         # The end will run on, but it will be tagged as POST for runs
         # that finish normally
 
-        # Pull the run number and labels for each phase from the arrays
-        iter_run = runNum[phaseIdx]
-        iter_phase = labels[phaseIdx]
+        # Pull the run number and label for the phase from the lookup table
+        iter_run, iter_phase = phaseTags[phaseIdx]
+        if restrictedOutput and iter_phase not in allowedPhases:
+            continue  # not writing this one out, so we're done with it
 
-        if fileType == "s":
+        if isSflow:
             totalMibs = None
             if (row[SFLOW_CNTR_INOCT_FIELD_IDX] is not None 
                     and row[SFLOW_CNTR_OUTOCT_FIELD_IDX] is not None):
@@ -298,31 +404,31 @@ def tagData(rd, wr):
                              row[SFLOW_CNTR_OUTOCT_FIELD_IDX]) / 1024 / 1024
             row.append(totalMibs)
 
-        # Add the tag info
-        row.insert(0, iter_phase)
-        row.insert(0, iter_run)
-                
-        # Write out the line
-        if restrictedOutput:
-            if printWarmup and iter_phase == PHASE_LABELS[3]:
-                wr.writerow(row)
-            if printRun and iter_phase == PHASE_LABELS[4]:
-                wr.writerow(row)
-            if printRunTail and iter_phase == PHASE_LABELS[5]:
-                wr.writerow(row)
+        # Add the tag info and write out the line
+        line = None
+        if quickWrite:
+            line = ",".join(row)
+            if (line.count(",") != len(row) - 1 or '"' in line
+                    or "\n" in line or "\r" in line):
+                line = None  # needs quoting, leave it to the csv writer
+        if line is not None:
+            write(phaseTagText[phaseIdx] + line + lineEnd)
         else:
-            wr.writerow(row)
+            writerow((iter_run, iter_phase, *row))
 
 # Globals
+parseTimestamp = timestampParser()
+parseSfslogTimestamp = timestampParser()
 dataFile = None
 sfslogFile = None
 outputFile = None
 fileType = None
 timeShift = None
+# -p still takes an object column for compatibility, but phases are now
+# found independently for every row, so it no longer affects the output
 obj_col = None
 # analyzer columns
 ana_ts_col = 1
-ana_obj_col = 0
 restrictedOutput = False
 printWarmup = False
 printRun = False
@@ -433,17 +539,56 @@ if timeShift != None:
         print("Unable to parse time shift string: ", err)
         sys.exit(3)
 
+# phases to write out when output is restricted
+allowedPhases = set()
+if printWarmup:
+    allowedPhases.add(PHASE_LABELS[3])  # 03_WARMUP
+if printRun:
+    allowedPhases.add(PHASE_LABELS[4])  # 04_RUN
+if printRunTail:
+    allowedPhases.add(PHASE_LABELS[5])  # 05_RUN_TAIL
+allowedPhases = frozenset(allowedPhases)
+
 # If we got this far, we might as well compile matching RegEx
-# for sfslog parsing
-rePreToInit = re.compile('^\s*Waiting to finish initialization\. (.+)$')
-reInitToWarmup = re.compile('^\s*(.+) Starting WARM phase.*$')
-reWarmupToRun = re.compile('^\s*(.+) Starting RUN phase.*$')
-reRunToRunTail = re.compile('^\s*(.+) Run 90 percent complete.*$')
-reRunTailToPost = re.compile('^\s*Tests finished: (.+)$')
-rePostToPre = re.compile('^<<< (.+): Starting.*$')
+# for timestamp field auto-detection
+# (only the start of a field needs to look like a timestamp, so there's no
+# point in capturing or anchoring the rest of it - but something must follow
+# the last digits, which keeps short values like 1.2.3 from matching)
+reFullTimestamp = re.compile(
+    r'^\s*\d{1,4}[/\-.]\d{1,4}[/\-.]\d{1,4}[T,]?\s+\d{1,2}[:.]\d{1,2}(?:[:.]\d{1,2})?\s*(?:[AP]M)?(?=.)')
+reDatestamp = re.compile(r'^\s*\d{1,4}[/\-.]\d{1,4}[/\-.]\d{1,4}(?=.)')
+reIPv4Addr = re.compile(r'^\s*\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\s*$')
+reTimestamp = re.compile(r'^\s*\d{1,2}[:.]\d{1,2}[:.]\d{1,2}\s*(?:[AP]M)?(?=.)')
+# and for timestamps that can be compared as text (ISO 8601, zero-padded,
+# no fractional seconds or time zone)
+# (ASCII digits only, since other digits don't sort with the transition
+# times, and no year 0, which the parser rejects)
+reSortableTimestamp = re.compile(
+    r'(?P<year>(?!0000)[0-9]{4})-(?P<month>0[1-9]|1[0-2])'
+    r'-(?P<day>0[1-9]|[12][0-9]|3[01])'
+    r'(?P<sep>[ T])(?:[01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]\Z')
 
-# setup for pivoted object types
-assert obj_col is not None
+# The sfslog transitions share a single pattern with one named group per
+# transition, so each log line only goes through the regex engine once
+reSfslog = re.compile(
+    r'^\s*(?:Waiting to finish initialization\. (?P<init>.+)'
+    r'|(?P<warm>.+) Starting WARM phase'
+    r'|(?P<run>.+) Starting RUN phase'
+    r'|(?P<tail>.+) Run 90 percent complete'
+    r'|Tests finished: (?P<post>.+))'
+    r'|^<<< (?P<pre>.+): Starting')
+# transition => (label of the phase it starts, does it start a new run)
+sfslogTransitions = {
+    'init': (PHASE_LABELS[2], False),  # 02_INIT
+    'warm': (PHASE_LABELS[3], False),  # 03_WARMUP
+    'run': (PHASE_LABELS[4], False),   # 04_RUN
+    'tail': (PHASE_LABELS[5], False),  # 05_RUN_TAIL
+    'post': (PHASE_LABELS[6], False),  # 06_POST
+    'pre': (PHASE_LABELS[1], True),    # 01_PRE
+}
+# with RUN and RUN_TAIL combined, the 90 percent mark isn't a transition
+if combineRunAndTail:
+    del sfslogTransitions['tail']
 
 # initialize the run label and run number lists with values
 labels.append(PHASE_LABELS[0])  # 00_PRE_TEST
@@ -456,88 +601,46 @@ with open(sfslogFile, mode="r", newline='') as sfslog:
     run = 0
     for logline in sfslog:
         lastline = logline
-        linematch = rePreToInit.match(logline)
-        if linematch:
-            try:
-                date = parser.parse(linematch.group(1))
-                times.append(date)
-                labels.append(PHASE_LABELS[2])  # 02_INIT
-                runNum.append(run)
-            except ValueError:
-                print('Bad date: %s' % linematch.group(1))
-        linematch = reInitToWarmup.match(logline)
-        if linematch:
-            try:
-                date = parser.parse(linematch.group(1))
-                times.append(date)
-                labels.append(PHASE_LABELS[3])  # 03_WARMUP
-                runNum.append(run)
-            except ValueError:
-                print('Bad date: %s' % linematch.group(1))
-        linematch = reWarmupToRun.match(logline)
-        if linematch:
-            try:
-                date = parser.parse(linematch.group(1))
-                times.append(date)
-                labels.append(PHASE_LABELS[4])  # 04_RUN
-                runNum.append(run)
-            except ValueError:
-                print('Bad date: %s' % linematch.group(1))
-        linematch = reRunToRunTail.match(logline)
-        if linematch and not combineRunAndTail:
-            try:
-                date = parser.parse(linematch.group(1))
-                times.append(date)
-                labels.append(PHASE_LABELS[5])  # 05_RUN_TAIL
-                runNum.append(run)
-            except ValueError:
-                print('Bad date: %s' % linematch.group(1))
-        linematch = reRunTailToPost.match(logline)
-        if linematch:
-            try:
-                date = parser.parse(linematch.group(1))
-                times.append(date)
-                labels.append(PHASE_LABELS[6])  # 06_POST
-                runNum.append(run)
-            except ValueError:
-                print('Bad date: %s' % linematch.group(1))
-        linematch = rePostToPre.match(logline)
-        if linematch:
-            try:
-                date = parser.parse(linematch.group(1))
+        linematch = reSfslog.match(logline)
+        if not linematch:
+            continue
+        transition = linematch.lastgroup
+        if transition not in sfslogTransitions:
+            continue
+        label, newRun = sfslogTransitions[transition]
+        try:
+            date = parseSfslogTimestamp(linematch.group(transition))
+            if newRun:
                 run += 1  # increment run number
-                times.append(date)
-                labels.append(PHASE_LABELS[1])  # 01_PRE
-                runNum.append(run)
-            except ValueError:
-                print('Bad date: %s' % linematch.group(1))
+            times.append(date)
+            labels.append(label)
+            runNum.append(run)
+        except ValueError:
+            print('Bad date: %s' % linematch.group(transition))
 
 # duplicate the first time value to satisfy the tagging algorithm
 times.insert(0, times[0])
 
+# the phases are fixed from here on, so freeze them - the transition times
+# for the bisect, and the (run number, label) tag for each phase built once,
+# rather than pulling both out of separate lists for every row of data
+times = tuple(times)
+phaseTags = tuple(zip(runNum, labels))
+
 # setup for and commence tagging the data
 if (outputFile == None):
-    # we're writing to STDOUT so no need to open the output
-    with open(dataFile, mode="r", newline='') as infile:
-        rdr = None
-        wrt = None
-        if (fileType == "a") or (fileType == "c") or (fileType == "s") or (fileType == "p"):
-            rdr = csv.reader(infile, delimiter=',', quotechar='"')
-        assert rdr != None, "Unhandled file type"
-        wrt = csv.writer(sys.stdout, delimiter=',',
-                         quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        assert wrt != None, "Error opening csv writer"
-        tagData(rdr, wrt)
+    # we're writing to STDOUT, so write through our own buffered file object
+    # on its descriptor (without closing it when we're done), after flushing
+    # anything already printed
+    sys.stdout.flush()
+    output = sys.stdout.fileno()
 else:
-    # we're writing to a file, so we open both files in a single with
-    with open(dataFile, mode="r", newline='') as infile, \
-            open(outputFile, mode="w", newline='') as outfile:
-        rdr = None
-        wrt = None
-        if (fileType == "a") or (fileType == "c") or (fileType == "s") or (fileType == "p"):
-            rdr = csv.reader(infile, delimiter=',', quotechar='"')
-        assert rdr != None, "Unhandled file type"
-        wrt = csv.writer(outfile, delimiter=',', quotechar='"',
-                         quoting=csv.QUOTE_MINIMAL)
-        assert wrt != None, "Error opening csv writer"
-        tagData(rdr, wrt)
+    output = outputFile
+with open(dataFile, mode="r", newline='',
+          buffering=IO_BUFFER_SIZE) as infile, \
+        open(output, mode="w", newline='', buffering=IO_BUFFER_SIZE,
+             closefd=(outputFile != None)) as outfile:
+    rdr = readRows(infile)
+    wrt = csv.writer(outfile, delimiter=',', quotechar='"',
+                     quoting=csv.QUOTE_MINIMAL)
+    tagData(rdr, wrt, outfile)